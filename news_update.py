@@ -1,19 +1,28 @@
 # update_news.py
 import re
-import requests
+import asyncio
+import hashlib
+import string
+import aiohttp
+import aiofiles
+from aiohttp_client_cache import CachedSession, SQLiteBackend
 import json
+import orjson
 import os
 from gtts import gTTS
 from datetime import datetime
+from io import BytesIO
 from pydantic import BaseModel, Field
 from typing import List
 from google import genai
 from google.genai import types
-import xml.etree.ElementTree as ET # Added for Entrez
-import time # Added for Entrez
+from lxml import etree # Added for Entrez
 
 NEWS_PATH = "news.jsonl"
 PROCESSED_IDS_PATH = "processed_ids.txt"
+PROCESSED_HASHES_PATH = "processed_hashes.txt"
+NEWS_WRITE_BUFFER_SIZE = 1024 * 1024
+NEWS_QUEUE_SIZE = 32
 
 # 特殊標記，用於獲取最新的 PubMed 文章，不指定醫學關鍵詞
 GET_LATEST_PUBMED_FLAG = "__GET_LATEST_PUBMED_ARTICLES__"
@@ -29,7 +38,33 @@ QUERY = [
 
 # === Entrez API Constants ===
 EUTILS_BASE_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
-# API_KEY = None # Consider using an API key for higher request rates
+NCBI_API_KEY = os.getenv("NCBI_API_KEY")
+# NCBI 未使用 API 金鑰時限制每秒 3 個請求，有金鑰時為 10 個：同時請求數等於上限，
+# 且每個名額在回應收到後再保留 1 秒，同一名額的兩個請求抵達 NCBI 的間隔必定超過 1 秒
+ENTREZ_MAX_CONCURRENCY = 10 if NCBI_API_KEY else 3
+ENTREZ_MIN_INTERVAL = 1.0
+ENTREZ_TIMEOUT = 10
+# EFetch XML 體積大，明確要求 gzip 壓縮傳輸；並以固定 User-Agent 標示本工具
+ENTREZ_HEADERS = {
+    "Accept-Encoding": "gzip, deflate",
+    "User-Agent": "EntrezAudioNews/1.0",
+}
+# 本地 SQLite 快取：排程密集觸發時，10 分鐘內相同的 ESearch/EFetch 請求直接讀取快取
+ENTREZ_CACHE_NAME = "entrez_cache"
+ENTREZ_CACHE_EXPIRE_SECONDS = 600
+# 遇到速率限制 (429) 或伺服器錯誤時以指數退避重試
+ENTREZ_RETRY_TOTAL = 3
+ENTREZ_RETRY_BACKOFF = 0.5
+ENTREZ_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# === EFetch XML 解析用的預先編譯 XPath，每篇文章重複使用 ===
+PMID_XP = etree.XPath(".//PMID")
+TITLE_XP = etree.XPath(".//ArticleTitle")
+ABSTRACT_XP = etree.XPath(".//Abstract/AbstractText")
+AUTHOR_XP = etree.XPath("(.//AuthorList)[1]//Author")
+PUBDATE_XP = etree.XPath(".//Journal/JournalIssue/PubDate")
+HISTORY_PUBDATE_XP = etree.XPath(".//PubmedData/History/PubMedPubDate")
+HISTORY_PUBDATE_BY_STATUS_XP = etree.XPath(".//PubmedData/History/PubMedPubDate[@PubStatus=$status]")
 
 # === 設定 Gemini API 金鑰 ===
 client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
@@ -46,19 +81,80 @@ class ArticleTranslation(BaseModel):
     )
     # pitch field is intentionally omitted as per user's latest news_update.py
 
-# === 輔助函式：讀取與儲存已處理的 ID ===
-def load_processed_ids(path=PROCESSED_IDS_PATH):
+# === 輔助函式：讀取與附加逐行儲存的狀態檔 (已處理的 PMID、摘要雜湊) ===
+def load_lines(path):
     if not os.path.exists(path):
         return set()
     with open(path, "r") as f:
-        return set(line.strip() for line in f.readlines())
-
-def save_processed_ids(ids, path=PROCESSED_IDS_PATH):
-    with open(path, "w") as f:
-        f.write("\n".join(ids))
+        # 直接走訪檔案逐行建立集合，不先把整個檔案讀成 list
+        lines = set(line.strip() for line in f)
+    lines.discard("")
+    return lines
+
+def append_lines(new_lines, path):
+    """只把本次新增的項目附加到檔案尾端，不重寫整個檔案"""
+    if not new_lines:
+        return
+    with open(path, "ab+") as f:
+        # 舊版程式寫入的檔案沒有結尾換行，先補上以免和新的項目黏在一起
+        if f.seek(0, os.SEEK_END) > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+        f.writelines(f"{line}\n".encode() for line in new_lines)
+
+# === 以摘要內容去重：同一摘要以不同 PMID 重新收錄時 (勘誤、預印本轉正式期刊) 也能辨識 ===
+_PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+
+def abstract_hash(summary):
+    """將摘要正規化 (小寫、去標點、合併空白) 後計算 blake2b 雜湊"""
+    normalized = " ".join(summary.lower().translate(_PUNCTUATION_TABLE).split())
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
 
 # === Entrez API 輔助函式 ===
-def search_pubmed(query, retmax=5, api_key=None):
+def create_entrez_session():
+    """建立共用連線池並帶有本地快取的 session，讓所有 E-utilities 請求重複使用已建立的 TLS 連線"""
+    cache = SQLiteBackend(
+        cache_name=ENTREZ_CACHE_NAME,
+        expire_after=ENTREZ_CACHE_EXPIRE_SECONDS,
+        allowed_methods=("GET",),
+        ignored_params=["api_key"], # 快取鍵不含 API 金鑰
+    )
+    connector = aiohttp.TCPConnector(limit_per_host=10, keepalive_timeout=30)
+    return CachedSession(
+        cache=cache,
+        connector=connector,
+        headers=ENTREZ_HEADERS,
+        timeout=aiohttp.ClientTimeout(total=ENTREZ_TIMEOUT),
+    )
+
+async def entrez_get(session, entrez_semaphore, endpoint, params):
+    """在 NCBI 速率限制內送出 E-utilities GET 請求，回傳原始回應內容；429/5xx 與連線錯誤會自動重試"""
+    for attempt in range(ENTREZ_RETRY_TOTAL + 1):
+        is_last_attempt = attempt == ENTREZ_RETRY_TOTAL
+        async with entrez_semaphore:
+            hit_network = True
+            try:
+                async with session.get(f"{EUTILS_BASE_URL}{endpoint}", params=params) as response:
+                    hit_network = not getattr(response, "from_cache", False)
+                    if is_last_attempt or response.status not in ENTREZ_RETRY_STATUSES:
+                        response.raise_for_status()
+                        return await response.read()
+                    reason = f"HTTP {response.status}"
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if is_last_attempt:
+                    raise
+                reason = repr(e)
+            finally:
+                # 回應收到後 (連線建立、TLS 握手都已完成) 再保留名額 ENTREZ_MIN_INTERVAL 秒，
+                # 確保每秒抵達 NCBI 的請求不超過上限；快取命中時沒有實際連線到 NCBI，直接釋放名額
+                if hit_network:
+                    await asyncio.sleep(ENTREZ_MIN_INTERVAL)
+        delay = ENTREZ_RETRY_BACKOFF * 2 ** attempt
+        print(f"{endpoint} 請求失敗 ({reason})，{delay} 秒後重試...")
+        await asyncio.sleep(delay)
+
+async def search_pubmed(session, entrez_semaphore, query, retmax=5, api_key=None):
     """使用 ESearch 搜尋 PubMed 文章 ID (PMID)"""
     
     search_term = query
@@ -78,10 +174,10 @@ def search_pubmed(query, retmax=5, api_key=None):
     if api_key:
         params["api_key"] = api_key
 
+    content = b""
     try:
-        response = requests.get(f"{EUTILS_BASE_URL}esearch.fcgi", params=params)
-        response.raise_for_status() 
-        data = response.json()
+        content = await entrez_get(session, entrez_semaphore, "esearch.fcgi", params)
+        data = json.loads(content)
         
         pmids = data.get("esearchresult", {}).get("idlist", [])
         if pmids:
@@ -89,13 +185,44 @@ def search_pubmed(query, retmax=5, api_key=None):
         else:
             print(f"ESearch 未找到任何 PMID (查詢詞: '{search_term}')。")
         return pmids
-    except requests.exceptions.RequestException as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         print(f"ESearch 請求失敗 (查詢詞: '{search_term}'): {e}")
     except json.JSONDecodeError:
-        print(f"ESearch 回應 JSON 解碼失敗 (查詢詞: '{search_term}')。回應內容：\n{response.text}")
+        print(f"ESearch 回應 JSON 解碼失敗 (查詢詞: '{search_term}')。回應內容：\n{content.decode('utf-8', 'replace')}")
     return []
 
-def fetch_pubmed_articles_details(pmids, api_key=None):
+# Year / Month / Day 以 "|" 串接後一次比對；Month 可能是數字、英文縮寫 (例如 "Jan") 或其他字串 (例如 "Dec-Jan")
+_PUB_DATE_RE = re.compile(r"^(\d+)(?:\|([^|]+))?(?:\|(\d+))?$")
+
+def format_pub_date(date_node):
+    """將 PubDate / PubMedPubDate 節點轉成 YYYY[-MM[-DD]] 字串，找不到年份時回傳 None"""
+    parts = [date_node.findtext("Year") or ""]
+    month = date_node.findtext("Month")
+    day = date_node.findtext("Day")
+    if month:
+        parts.append(month)
+        # 日期只接受純數字，其他格式 (例如 "5-6") 略過
+        if day and day.isdigit():
+            parts.append(day)
+    match = _PUB_DATE_RE.match("|".join(parts))
+    if not match:
+        return None
+
+    year, month, day = match.groups()
+    if not month:
+        return year
+    if month.isdigit():
+        month = month.zfill(2)
+    else:
+        try:
+            month = f"{datetime.strptime(month, '%b').month:02d}"
+        except ValueError:
+            pass # 保留原始字串
+    if day:
+        return f"{year}-{month}-{day.zfill(2)}"
+    return f"{year}-{month}"
+
+async def fetch_pubmed_articles_details(session, entrez_semaphore, pmids, api_key=None):
     """使用 EFetch 根據 PMID 列表取得文章詳細資訊 (摘要、作者、日期)"""
     if not pmids:
         return []
@@ -111,26 +238,26 @@ def fetch_pubmed_articles_details(pmids, api_key=None):
         params["api_key"] = api_key
 
     articles_data = []
+    content = b""
     try:
-        response = requests.get(f"{EUTILS_BASE_URL}efetch.fcgi", params=params)
-        response.raise_for_status()
+        content = await entrez_get(session, entrez_semaphore, "efetch.fcgi", params)
         
-        root = ET.fromstring(response.content)
-        for pubmed_article in root.findall(".//PubmedArticle"):
+        # 逐篇串流解析，處理完的 PubmedArticle 立即釋放，記憶體不隨 retmax 成長
+        for _, pubmed_article in etree.iterparse(BytesIO(content), tag="PubmedArticle"):
             article_info = {}
-            pmid_node = pubmed_article.find(".//PMID")
-            if pmid_node is not None:
-                article_info["pmid"] = pmid_node.text
+            pmid_nodes = PMID_XP(pubmed_article)
+            if pmid_nodes:
+                article_info["pmid"] = pmid_nodes[0].text
             
-            title_node = pubmed_article.find(".//ArticleTitle")
-            if title_node is not None:
-                article_info["title"] = "".join(title_node.itertext()).strip()
+            title_nodes = TITLE_XP(pubmed_article)
+            if title_nodes:
+                article_info["title"] = "".join(title_nodes[0].itertext()).strip()
             else:
                 article_info["title"] = "無標題"
 
             # 解析摘要
             abstract_parts = []
-            for part_node in pubmed_article.findall(".//Abstract/AbstractText"):
+            for part_node in ABSTRACT_XP(pubmed_article):
                 text_content = "".join(part_node.itertext()).strip()
                 if text_content:
                     label = part_node.get("Label")
@@ -146,124 +273,108 @@ def fetch_pubmed_articles_details(pmids, api_key=None):
 
             # 解析作者
             authors_list = []
-            author_list_node = pubmed_article.find(".//AuthorList")
-            if author_list_node is not None:
-                for author_node in author_list_node.findall(".//Author"):
-                    lastname_node = author_node.find(".//LastName")
-                    forename_node = author_node.find(".//ForeName")
-                    initials_node = author_node.find(".//Initials") # 備用
-                    
-                    author_name = ""
-                    if lastname_node is not None and lastname_node.text:
-                        author_name += lastname_node.text
-                    if forename_node is not None and forename_node.text:
-                        author_name += f" {forename_node.text}"
-                    elif initials_node is not None and initials_node.text: # 如果沒有 ForeName，嘗試使用 Initials
-                        author_name += f" {initials_node.text}"
-                    
-                    if author_name.strip():
-                        authors_list.append(author_name.strip())
+            for author_node in AUTHOR_XP(pubmed_article):
+                lastname = author_node.findtext("LastName")
+                forename = author_node.findtext("ForeName")
+                initials = author_node.findtext("Initials") # 備用
+                
+                author_name = ""
+                if lastname:
+                    author_name += lastname
+                if forename:
+                    author_name += f" {forename}"
+                elif initials: # 如果沒有 ForeName，嘗試使用 Initials
+                    author_name += f" {initials}"
+                
+                if author_name.strip():
+                    authors_list.append(author_name.strip())
             article_info["authors"] = authors_list if authors_list else ["無作者資訊"]
 
             # 解析出版日期 (嘗試多種可能的路徑)
             pub_date_str = "無出版日期"
             # 嘗試從 Journal/JournalIssue/PubDate 獲取
-            journal_pubdate_node = pubmed_article.find(".//Journal/JournalIssue/PubDate")
-            if journal_pubdate_node is not None:
-                year = journal_pubdate_node.findtext("Year")
-                month = journal_pubdate_node.findtext("Month")
-                day = journal_pubdate_node.findtext("Day")
-                if year:
-                    pub_date_str = year
-                    if month:
-                        # 確保月份是數字
-                        if month.isdigit():
-                            pub_date_str += f"-{month.zfill(2)}"
-                        else: # 有些月份可能是英文縮寫，例如 "Jan"
-                            try:
-                                month_num = datetime.strptime(month, "%b").month
-                                pub_date_str += f"-{str(month_num).zfill(2)}"
-                            except ValueError:
-                                pub_date_str += f"-{month}" # 保留原始字串
-                        if day and day.isdigit():
-                            pub_date_str += f"-{day.zfill(2)}"
+            journal_pubdate_nodes = PUBDATE_XP(pubmed_article)
+            if journal_pubdate_nodes:
+                pub_date_str = format_pub_date(journal_pubdate_nodes[0]) or pub_date_str
             
             # 如果 Journal PubDate 找不到或不完整，嘗試從 PubMedPubDate (取 status='pubmed' 的那個)
             # 通常 PubMedPubDate 會有更標準的日期
             if pub_date_str == "無出版日期" or len(pub_date_str) < 10: # YYYY-MM-DD
-                pubmed_pubdate_nodes = pubmed_article.findall(".//PubmedData/History/PubMedPubDate[@PubStatus='pubmed']")
+                pubmed_pubdate_nodes = HISTORY_PUBDATE_BY_STATUS_XP(pubmed_article, status="pubmed")
                 if not pubmed_pubdate_nodes: 
-                    pubmed_pubdate_nodes = pubmed_article.findall(".//PubmedData/History/PubMedPubDate[@PubStatus='entrez']")
+                    pubmed_pubdate_nodes = HISTORY_PUBDATE_BY_STATUS_XP(pubmed_article, status="entrez")
                 if not pubmed_pubdate_nodes:
-                    pubmed_pubdate_nodes = pubmed_article.findall(".//PubmedData/History/PubMedPubDate")
-
+                    pubmed_pubdate_nodes = HISTORY_PUBDATE_XP(pubmed_article)
 
                 if pubmed_pubdate_nodes: 
-                    selected_pubdate_node = pubmed_pubdate_nodes[0] # 通常第一個是比較相關的
-                    year = selected_pubdate_node.findtext("Year")
-                    month = selected_pubdate_node.findtext("Month")
-                    day = selected_pubdate_node.findtext("Day")
-                    current_date_str = "無出版日期"
-                    if year and year.isdigit():
-                        current_date_str = year
-                        if month and month.isdigit():
-                            current_date_str += f"-{month.zfill(2)}"
-                            if day and day.isdigit():
-                                current_date_str += f"-{day.zfill(2)}"
-                    
+                    current_date_str = format_pub_date(pubmed_pubdate_nodes[0]) # 通常第一個是比較相關的
                     # 更新 pub_date_str 如果找到了更完整的日期
-                    if current_date_str != "無出版日期" and len(current_date_str) > len(pub_date_str.replace("無出版日期","")):
+                    if current_date_str and len(current_date_str) > len(pub_date_str.replace("無出版日期","")):
                         pub_date_str = current_date_str
             
             article_info["published_date"] = pub_date_str
             
             articles_data.append(article_info)
+
+            pubmed_article.clear()
+            while pubmed_article.getprevious() is not None:
+                del pubmed_article.getparent()[0]
         
         print(f"EFetch 成功解析 {len(articles_data)} 篇文章的資訊。")
         return articles_data
         
-    except requests.exceptions.RequestException as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         print(f"EFetch 請求失敗：{e}")
-    except ET.ParseError as e:
-        print(f"EFetch XML 解析失敗：{e}\n回應內容：\n{response.text[:500]}...")
+    except etree.XMLSyntaxError as e:
+        print(f"EFetch XML 解析失敗：{e}\n回應內容：\n{content[:500].decode('utf-8', 'replace')}...")
     return []
 
 # === 抓取 Entrez PubMed 研究文章 (適用於 news_update.py) ===
-def fetch_entrez_articles_for_news_update(query_term, articles_per_query=1):
-    processed_ids = load_processed_ids()
-    
-    display_query_term = query_term
+def display_query_name(query_term):
     if query_term == GET_LATEST_PUBMED_FLAG:
-        display_query_term = "最新 PubMed 文章 (無特定關鍵詞)"
-    print(f"為查詢 '{display_query_term}' 從 PubMed 抓取文章...")
+        return "最新 PubMed 文章 (無特定關鍵詞)"
+    return query_term
+
+async def fetch_entrez_articles_for_news_update(session, entrez_semaphore, queries, processed_ids, newly_added, seen_hashes, new_hashes, articles_per_query=1):
+    """每個查詢各自 ESearch (同時送出)，挑出未處理的 PMID 後以單一 EFetch 取得全部文章"""
+    for query_term in queries:
+        print(f"為查詢 '{display_query_name(query_term)}' 從 PubMed 抓取文章...")
 
     pmids_to_search = articles_per_query + 15 
     
-    all_found_pmids = search_pubmed(query_term, retmax=pmids_to_search)
-    
-    if not all_found_pmids:
-        return []
+    search_results = await asyncio.gather(
+        *[search_pubmed(session, entrez_semaphore, query_term, retmax=pmids_to_search, api_key=NCBI_API_KEY) for query_term in queries]
+    )
 
-    new_pmids_to_fetch_details = []
-    for pmid in all_found_pmids:
-        if pmid not in processed_ids:
-            new_pmids_to_fetch_details.append(pmid)
-            if len(new_pmids_to_fetch_details) >= articles_per_query:
-                break
+    # 依查詢順序挑選新的 PMID，記錄每篇來自哪個查詢；前面查詢挑過的 PMID 不再重複
+    pmid_sources = {}
+    for query_term, all_found_pmids in zip(queries, search_results):
+        new_pmids_for_query = 0
+        for pmid in all_found_pmids:
+            if pmid not in processed_ids and pmid not in pmid_sources:
+                pmid_sources[pmid] = query_term
+                new_pmids_for_query += 1
+                if new_pmids_for_query >= articles_per_query:
+                    break
+        
+        if not new_pmids_for_query:
+            print(f"沒有為查詢 '{display_query_name(query_term)}' 找到新的、未處理的 PMID。")
     
-    if not new_pmids_to_fetch_details:
-        print(f"沒有為查詢 '{display_query_term}' 找到新的、未處理的 PMID。")
+    if not pmid_sources:
         return []
 
-    time.sleep(0.4) 
-    
-    raw_articles_details = fetch_pubmed_articles_details(new_pmids_to_fetch_details)
+    # EFetch 接受以逗號分隔的 PMID 列表，所有查詢共用一次請求
+    raw_articles_details = await fetch_pubmed_articles_details(session, entrez_semaphore, list(pmid_sources), api_key=NCBI_API_KEY)
 
     formatted_articles = []
     for raw_article in raw_articles_details:
         pmid = raw_article.get("pmid")
-        if not pmid:
+        if pmid not in pmid_sources or pmid in processed_ids:
             continue
+        # 只標記 EFetch 確實取回的 PMID；EFetch 失敗時不寫入，下次執行會重新抓取。
+        # 摘要過短或重複的文章也會標記 (與舊版不同)，避免查詢每次都卡在同一篇無法使用的 PMID
+        processed_ids.add(pmid)
+        newly_added.append(pmid)
 
         title = raw_article.get("title", "無標題")
         summary = raw_article.get("abstract", "無摘要")
@@ -271,11 +382,19 @@ def fetch_entrez_articles_for_news_update(query_term, articles_per_query=1):
         if not summary or len(summary.strip()) < 50:
             print(f"PMID {pmid} ('{title}') 的摘要過短或不存在，跳過。")
             continue
+
+        summary_hash = abstract_hash(summary)
+        if summary_hash in seen_hashes:
+            print(f"PMID {pmid} ('{title}') 的摘要與已處理的文章相同，跳過。")
+            continue
+        seen_hashes.add(summary_hash)
+        new_hashes.append(summary_hash)
         
         # 從 raw_article 中獲取作者和日期
         authors = raw_article.get("authors", ["作者資訊待解析"])
         published_date = raw_article.get("published_date", "日期資訊待解析")
         
+        query_term = pmid_sources[pmid]
         article_query_source = query_term
         if query_term == GET_LATEST_PUBMED_FLAG:
             article_query_source = "Latest PubMed Articles" # Store a meaningful query source
@@ -293,14 +412,20 @@ def fetch_entrez_articles_for_news_update(query_term, articles_per_query=1):
             "source": "PubMed"
         }
         formatted_articles.append(article_data)
-        processed_ids.add(pmid) 
-    
-    save_processed_ids(processed_ids)
     
     return formatted_articles
 
 # === 使用 Gemini 結構化輸出進行翻譯 ===
-def summarize_to_chinese(title, summary):
+def translation_fallback(title, error):
+    """翻譯失敗時使用的預設內容"""
+    return {
+        "title_zh": f"[翻譯失敗] {title}",
+        "summary_zh": f"摘要翻譯失敗：{str(error)}",
+        "applications": ["應用場景1：翻譯失敗", "應用場景2：翻譯失敗", "應用場景3：翻譯失敗"]
+        # pitch is not included
+    }
+
+async def summarize_to_chinese(title, summary):
     """使用新的 Google GenAI SDK 和結構化輸出進行研究文章翻譯"""
     prompt = (
         f"請將以下生醫研究文章標題與摘要翻譯成繁體中文，並完成以下任務：\n"
@@ -311,7 +436,7 @@ def summarize_to_chinese(title, summary):
     )
     
     try:
-        response = client.models.generate_content(
+        response = await client.aio.models.generate_content(
             model='gemini-2.0-flash-001',
             contents=prompt,
             config=types.GenerateContentConfig(
@@ -333,82 +458,94 @@ def summarize_to_chinese(title, summary):
         
     except Exception as e:
         print(f"翻譯過程中發生錯誤: {e}")
-        return {
-            "title_zh": f"[翻譯失敗] {title}",
-            "summary_zh": f"摘要翻譯失敗：{str(e)}",
-            "applications": ["應用場景1：翻譯失敗", "應用場景2：翻譯失敗", "應用場景3：翻譯失敗"]
-            # pitch is not included
-        }
+        return translation_fallback(title, e)
 
 # === 將摘要轉成語音檔 ===
-def save_audio(text, filename):
+async def save_audio(text, filename):
     try:
         tts = gTTS(text, lang='zh-tw')
-        tts.save(filename)
+        # gTTS 是同步函式庫：在執行緒中把 MP3 寫入記憶體，再以 aiofiles 非同步寫檔，不阻塞其他文章的翻譯
+        buffer = BytesIO()
+        await asyncio.to_thread(tts.write_to_fp, buffer)
+        async with aiofiles.open(filename, "wb") as f:
+            await f.write(buffer.getvalue())
     except Exception as e:
         print(f"語音生成失敗: {e}")
 
+# === 處理單篇文章：翻譯、語音、組成輸出資料 ===
+async def process_article(i, article_detail, news_queue):
+    print(f"======== 正在處理已抓取的第 {i+1} 篇文章: {article_detail['title']} ========")
+    translation_result = await summarize_to_chinese(article_detail['title'], article_detail['summary'])
+    
+    audio_content = (
+        f"{translation_result['title_zh']}\n\n"
+        f"{translation_result['summary_zh']}\n\n"
+        f"這項研究的應用場景：\n"
+        f"第一，{translation_result['applications'][0]}\n"
+        f"第二，{translation_result['applications'][1]}\n" 
+        f"第三，{translation_result['applications'][2]}\n\n"
+    )
+    
+    audio_path = f"audios/{article_detail['id']}.mp3" # Use PMID for filename
+    await save_audio(audio_content, audio_path)
+
+    article_data_to_save = article_detail.copy()
+    article_data_to_save.update({
+        "title_zh": translation_result['title_zh'],
+        "summary_zh": translation_result['summary_zh'],
+        "applications": translation_result['applications'],
+        # "pitch": translation_result.get('pitch', 'N/A'), # pitch is not in translation_result
+        "audio": audio_path,
+        "timestamp": datetime.now().isoformat()
+    })
+    await news_queue.put(article_data_to_save)
+
+# === 背景寫入 news.jsonl：文章完成順序不定，依完成先後附加 ===
+async def write_news_records(news_queue, path=NEWS_PATH):
+    """持續從佇列取出文章資料寫入 news.jsonl，收到 None 時結束"""
+    # orjson 直接輸出 UTF-8 bytes (等同 ensure_ascii=False)，檔案以二進位附加模式開啟
+    with open(path, "ab", buffering=NEWS_WRITE_BUFFER_SIZE) as f:
+        while (article_data_to_save := await news_queue.get()) is not None:
+            f.write(orjson.dumps(article_data_to_save, option=orjson.OPT_APPEND_NEWLINE))
+        f.flush()
+
 # === 主流程 ===
-def main():
+async def main():
     os.makedirs("audios", exist_ok=True)
-
-    articles_collection = [] # Renamed to avoid confusion with 'articles' inside the loop
-    for query_idx, query_term in enumerate(QUERY):
-        display_query_log = query_term
-        if query_term == GET_LATEST_PUBMED_FLAG:
-            display_query_log = "最新 PubMed 文章 (無特定關鍵詞)"
-        
-        print(f"======== 正在處理查詢: {display_query_log} ========")
-        if query_idx > 0:
-            print("在處理下一個查詢前，暫停1秒以遵守API速率限制...")
-            time.sleep(1) 
-
+    processed_ids = load_lines(PROCESSED_IDS_PATH)
+    newly_added = []
+    seen_hashes = load_lines(PROCESSED_HASHES_PATH)
+    new_hashes = []
+
+    # 所有查詢同時送出，速率由 entrez_semaphore 控制 (在執行中的事件迴圈內建立)
+    entrez_semaphore = asyncio.Semaphore(ENTREZ_MAX_CONCURRENCY)
+    async with create_entrez_session() as session:
         # Fetch 1 new article per query term
-        newly_fetched = fetch_entrez_articles_for_news_update(query_term, articles_per_query=1)
-        
-        if newly_fetched:
-            articles_collection.extend(newly_fetched)
-            # It's possible newly_fetched has more than one if articles_per_query was > 1
-            # and multiple new ones were found. For now, print the last one from the extended list.
-            if articles_collection:
-                 print(f"已抓取 '{articles_collection[-1]['title']}' (來源: {display_query_log})")
+        articles_collection = await fetch_entrez_articles_for_news_update(
+            session, entrez_semaphore, QUERY, processed_ids, newly_added, seen_hashes, new_hashes, articles_per_query=1
+        )
+
+    for article_detail in articles_collection:
+        print(f"已抓取 '{article_detail['title']}' (來源: {article_detail['query']})")
     
     print(f"======== 總共抓取到 {len(articles_collection)} 篇文章 ========")
     
     if not articles_collection:
         print("沒有抓到任何新文章，本次無更新。")
+        append_lines(newly_added, PROCESSED_IDS_PATH)
+        append_lines(new_hashes, PROCESSED_HASHES_PATH)
         return
         
-    for i, article_detail in enumerate(articles_collection): # Renamed to avoid confusion
-        print(f"======== 正在處理已抓取的第 {i+1} 篇文章: {article_detail['title']} ========")
-        translation_result = summarize_to_chinese(article_detail['title'], article_detail['summary'])
-        
-        audio_content = (
-            f"{translation_result['title_zh']}\n\n"
-            f"{translation_result['summary_zh']}\n\n"
-            f"這項研究的應用場景：\n"
-            f"第一，{translation_result['applications'][0]}\n"
-            f"第二，{translation_result['applications'][1]}\n" 
-            f"第三，{translation_result['applications'][2]}\n\n"
-        )
-        
-        audio_path = f"audios/{article_detail['id']}.mp3" # Use PMID for filename
-        save_audio(audio_content, audio_path)
-
-        article_data_to_save = article_detail.copy()
-        article_data_to_save.update({
-            "title_zh": translation_result['title_zh'],
-            "summary_zh": translation_result['summary_zh'],
-            "applications": translation_result['applications'],
-            # "pitch": translation_result.get('pitch', 'N/A'), # pitch is not in translation_result
-            "audio": audio_path,
-            "timestamp": datetime.now().isoformat()
-        })
-        
-        with open(NEWS_PATH, "a", encoding="utf-8") as f:
-            f.write(json.dumps(article_data_to_save, ensure_ascii=False) + "\n")
-
+    # 每篇文章各自翻譯後立即合成語音，文章之間互相重疊；完成的文章交給背景寫入工作
+    news_queue = asyncio.Queue(maxsize=NEWS_QUEUE_SIZE)
+    writer = asyncio.create_task(write_news_records(news_queue))
+    await asyncio.gather(*[process_article(i, a, news_queue) for i, a in enumerate(articles_collection)])
+    await news_queue.put(None)
+    await writer
+
+    append_lines(newly_added, PROCESSED_IDS_PATH)
+    append_lines(new_hashes, PROCESSED_HASHES_PATH)
     print("✅ 更新完成：news.jsonl 和 MP3 音檔已產生")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())